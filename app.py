@@ -1,10 +1,12 @@
 # app.py
 import os
+import re
+import sys
+import types
 import streamlit as st
-import json
-import requests
+import orjson
+import httpx
 from typing import List, Dict
-import time
 
 # Placeholder for your actual API key.
 # It's a best practice to use Streamlit secrets for this in a real-world app.
@@ -17,41 +19,176 @@ else:
 
 # Define the API URL and model name as constants
 MODEL_NAME = "gemini-2.0-flash-lite"
-API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{MODEL_NAME}:generateContent?key={GOOGLE_API_KEY}"
+# Stream the generation as server-sent events so tokens can be rendered as
+# they arrive instead of waiting for the full response body.
+API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{MODEL_NAME}:streamGenerateContent?alt=sse&key={GOOGLE_API_KEY}"
+# The Batch API is roughly half the cost of interactive calls and is the
+# right tool for non-time-sensitive bulk triage of accumulated incidents.
+BATCH_API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{MODEL_NAME}:batchGenerateContent?key={GOOGLE_API_KEY}"
+OPERATION_URL = "https://generativelanguage.googleapis.com/v1beta/{name}?key=" + GOOGLE_API_KEY
+
+# Reuse a single HTTP client across Streamlit reruns so repeated analyses
+# keep the TCP/TLS connection to the Gemini endpoint alive instead of paying
+# a fresh handshake on every click. HTTP/2 additionally multiplexes
+# overlapping calls (streaming plus batch polling) over one connection.
+@st.cache_resource
+def get_session() -> httpx.Client:
+    return httpx.Client(
+        http2=True,
+        timeout=60,
+        limits=httpx.Limits(max_connections=16, max_keepalive_connections=4),
+    )
 
 # --- Simulated Data and Knowledge Base (Very Light RAG) ---
 # In a real application, this would be a vector database or a proper data ingestion pipeline.
 # Here, we'll use a simple dictionary to represent our 'knowledge'.
-KNOWLEDGE_BASE = {
-    "high latency": {
+# Category names are shared module constants so the predict_incident_type
+# return values can't drift from the knowledge-base/template keys. Note that
+# st.cache_data pickles cached returns, so lookups on a cache hit still hash
+# a fresh string; interning only helps the uncached path. The mapping is
+# read-only so nothing can mutate it between reruns.
+HIGH_LATENCY = sys.intern("high latency")
+PACKET_LOSS = sys.intern("packet loss")
+SERVICE_UNREACHABLE = sys.intern("service unreachable")
+UNKNOWN = sys.intern("unknown")
+
+KNOWLEDGE_BASE = types.MappingProxyType({
+    HIGH_LATENCY: {
         "title": "High Network Latency Troubleshooting Guide",
         "content": "High latency can be caused by network congestion, firewall misconfigurations, or a slow server response. Correlate with network traffic logs (e.g., via `ping` or `traceroute`) and server performance metrics. The root cause is often identified by analyzing packet loss and jitter.",
         "actionable_intelligence": "Action: Investigate firewall rules for any recent changes and check server CPU/memory usage during peak latency."
     },
-    "packet loss": {
+    PACKET_LOSS: {
         "title": "Network Packet Loss Analysis",
         "content": "Packet loss indicates dropped packets during transmission. Common causes include faulty cabling, overloaded network devices (routers, switches), or insufficient bandwidth. Check device health, CPU/memory usage, and review interface counters for discard rates.",
         "actionable_intelligence": "Action: Ping network hops to isolate the area of packet loss and check device health metrics for signs of an overload."
     },
-    "service unreachable": {
+    SERVICE_UNREACHABLE: {
         "title": "Service Unreachable Troubleshooting",
         "content": "A 'service unreachable' error suggests a problem with DNS resolution, an incorrect IP address, or a service not running on the destination server. Start by verifying DNS and checking the service status (`systemctl status [service]`) on the target machine.",
         "actionable_intelligence": "Action: Perform a DNS lookup and verify the service is running. If both are correct, check routing tables for misconfigurations."
     }
+})
+
+# Fallback knowledge used when no category matches the incident.
+DEFAULT_CONTEXT = {
+    "title": "General Network Troubleshooting",
+    "content": "No specific match found in the knowledge base. The analysis will proceed with general best practices.",
+    "actionable_intelligence": "Action: Start with basic checks like connectivity (`ping`), device status, and recent configuration changes."
 }
 
+# Keep retrieved context within a fixed budget so prompt prefill cost stays
+# bounded if knowledge entries (or a future real RAG) grow long. Prefill
+# latency and input cost both scale with prompt tokens.
+MAX_CONTEXT_CHARS = 2000  # roughly 512 tokens at ~4 chars/token
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+")
+
+def _truncate_context(content: str) -> str:
+    """Trim context to the last whole sentence that fits the budget."""
+    if len(content) <= MAX_CONTEXT_CHARS:
+        return content
+    truncated = ""
+    for sentence in _SENTENCE_SPLIT_RE.split(content):
+        if len(truncated) + len(sentence) > MAX_CONTEXT_CHARS:
+            break
+        truncated += sentence + " "
+    return truncated.rstrip() or content[:MAX_CONTEXT_CHARS]
+
+# --- Prompt Templates ---
+# The knowledge-base fields never change for a given category, so each
+# category's prompt is rendered once at import time, leaving a single
+# {incident} hole to fill per call. The constant text comes first so
+# Gemini's implicit prompt caching can dedupe the shared prefix.
+def _render_prompt_template(context: Dict) -> str:
+    return f"""
+        Act as a senior network engineer and root cause analyst. Your task is to analyze a network incident and provide a clear, human-readable explanation of the root cause, including the 'why' behind the problem.
+
+        Based on the following retrieved network knowledge and incident description, generate a concise report.
+
+        **Retrieved Knowledge:**
+        Title: {context['title']}
+        Content: {_truncate_context(context['content'])}
+        Actionable Intelligence: {context['actionable_intelligence']}
+
+        Your response must include the following sections:
+        1.  **Identified Problem:** A single sentence summarizing the core issue.
+        2.  **Root Cause Analysis:** A brief paragraph explaining the 'why' behind the problem. Use the provided knowledge and connect it to the incident description.
+        3.  **Actionable Intelligence:** Extract and rephrase the "actionable intelligence" to provide a clear, next-step recommendation.
+
+        **Incident Description:**
+        {{incident}}
+        """
+
+# Streamlit re-executes this whole script on every widget interaction, so
+# the rendered templates live behind cache_resource: only the first rerun
+# pays for rendering and truncation, every later rerun gets the same dict.
+@st.cache_resource
+def get_prompt_templates() -> Dict[str, str]:
+    templates = {k: _render_prompt_template(v) for k, v in KNOWLEDGE_BASE.items()}
+    templates[UNKNOWN] = _render_prompt_template(DEFAULT_CONTEXT)
+    return templates
+
+_PROMPT_TEMPLATES = get_prompt_templates()
+
 # --- Predictive Analysis (Simulated) ---
+# Keyword patterns compiled once at import; re.IGNORECASE also avoids
+# allocating a lowercased copy of the description on every call.
+_LATENCY_RE = re.compile(r"latency|slow", re.IGNORECASE)
+_PACKET_LOSS_RE = re.compile(r"packet|drop", re.IGNORECASE)
+_UNREACHABLE_RE = re.compile(r"unreachable|down", re.IGNORECASE)
+
+@st.cache_data(max_entries=256, show_spinner=False)
 def predict_incident_type(incident_description: str) -> str:
     """A very simple predictive function based on keywords."""
-    incident_description = incident_description.lower()
-    if "latency" in incident_description or "slow" in incident_description:
-        return "high latency"
-    elif "packet" in incident_description or "drop" in incident_description:
-        return "packet loss"
-    elif "unreachable" in incident_description or "down" in incident_description:
-        return "service unreachable"
+    if _LATENCY_RE.search(incident_description):
+        return HIGH_LATENCY
+    elif _PACKET_LOSS_RE.search(incident_description):
+        return PACKET_LOSS
+    elif _UNREACHABLE_RE.search(incident_description):
+        return SERVICE_UNREACHABLE
     else:
-        return "unknown"
+        return UNKNOWN
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _gemini_generate(prompt: str) -> str:
+    """Stream one Gemini completion and return the full text.
+
+    Cached on the prompt string for an hour, so re-analyzing an identical
+    incident (retries, demo reruns) skips the network call entirely and
+    Streamlit replays the rendered output instead.
+    """
+    data = {
+        "contents": [
+            {
+                "parts": [{"text": prompt}]
+            }
+        ]
+    }
+    # Use the defined API_URL which now includes the GOOGLE_API_KEY
+    session = get_session()
+    response = session.send(session.build_request("POST", API_URL, json=data), stream=True)
+    try:
+        response.raise_for_status() # Raise an exception for bad status codes
+    except httpx.HTTPStatusError:
+        # Release the stream back to the pooled client before surfacing the
+        # error; stream_chunks' cleanup never runs on this path.
+        response.close()
+        raise
+
+    def stream_chunks():
+        # Each SSE event carries one partial candidate; yield its text
+        # as soon as it arrives so rendering overlaps the network.
+        # orjson's C parser keeps up with the many small fragments the
+        # SSE stream produces far better than stdlib json.
+        try:
+            for line in response.iter_lines():
+                if line.startswith("data: "):
+                    chunk = orjson.loads(line[6:])
+                    yield chunk['candidates'][0]['content']['parts'][0]['text']
+        finally:
+            response.close()
+
+    return st.write_stream(stream_chunks)
 
 # --- Agentic Workflow (Simplified LangGraph) ---
 # This simulates a LangGraph state machine with a simple, linear flow.
@@ -66,69 +203,51 @@ def agent_root_cause_analysis(incident: str) -> str:
 
     st.write("### 🤖 Agentic Analysis Started")
 
-    # Step 1: Predictive Analysis (Simulated)
-    with st.spinner("Step 1/3: Performing predictive analysis..."):
+    # Prediction and retrieval are pure Python and effectively free, so they
+    # run inline under one status; the only real work is the Gemini call.
+    with st.status("Analyzing incident...") as status:
         incident_type = predict_incident_type(incident)
-        time.sleep(1) # Simulate work
-        st.info(f"💡 Prediction: This incident is likely related to **{incident_type.replace('_', ' ')}**.")
-
-    # Step 2: Retrieval (Simple RAG)
-    with st.spinner("Step 2/3: Retrieving relevant knowledge..."):
-        # Retrieve context from our knowledge base based on the predicted type.
-        context = KNOWLEDGE_BASE.get(incident_type, {
-            "title": "General Network Troubleshooting",
-            "content": "No specific match found in the knowledge base. The analysis will proceed with general best practices.",
-            "actionable_intelligence": "Action: Start with basic checks like connectivity (`ping`), device status, and recent configuration changes."
-        })
-        time.sleep(1) # Simulate work
-        st.success("✅ Relevant knowledge found.")
-
-    # Step 3: LLM Generation (The core of the analysis)
-    with st.spinner("Step 3/3: Generating human-readable explanation..."):
-        # Construct the prompt for the Gemini API.
-        prompt = f"""
-        Act as a senior network engineer and root cause analyst. Your task is to analyze a network incident and provide a clear, human-readable explanation of the root cause, including the 'why' behind the problem.
-
-        Based on the following incident description and retrieved network knowledge, generate a concise report.
+        st.write(f"💡 Prediction: This incident is likely related to **{incident_type.replace('_', ' ')}**.")
+        # Fill the incident into the pre-rendered template for the Gemini API.
+        prompt = _PROMPT_TEMPLATES[incident_type].format(incident=incident)
+        status.update(label="Relevant knowledge retrieved.", state="complete")
 
-        **Incident Description:**
-        {incident}
-
-        **Retrieved Knowledge:**
-        Title: {context['title']}
-        Content: {context['content']}
-        Actionable Intelligence: {context['actionable_intelligence']}
+    # API Call
+    try:
+        generated_text = _gemini_generate(prompt)
+        st.success("✅ Analysis complete!")
+        return generated_text
 
-        Your response must include the following sections:
-        1.  **Identified Problem:** A single sentence summarizing the core issue.
-        2.  **Root Cause Analysis:** A brief paragraph explaining the 'why' behind the problem. Use the provided knowledge and connect it to the incident description.
-        3.  **Actionable Intelligence:** Extract and rephrase the "actionable intelligence" to provide a clear, next-step recommendation.
-        """
+    except Exception as e:
+        st.error(f"Error during LLM generation: {e}")
+        return "Unable to perform analysis. Please check your API key and network connection."
 
-        # API Call
-        try:
-            headers = {
-                'Content-Type': 'application/json'
-            }
-            data = {
-                "contents": [
-                    {
-                        "parts": [{"text": prompt}]
-                    }
-                ]
-            }
-            # Use the defined API_URL which now includes the GOOGLE_API_KEY
-            response = requests.post(API_URL, headers=headers, data=json.dumps(data))
-            response.raise_for_status() # Raise an exception for bad status codes
-            result = response.json()
-            generated_text = result['candidates'][0]['content']['parts'][0]['text']
-            time.sleep(2) # Simulate work
-            st.success("✅ Analysis complete!")
-            return generated_text
+# --- Bulk Analysis (Batch API) ---
+def submit_batch_analysis(incidents: List[str]) -> str:
+    """Submit one batch job covering all incidents and return the operation name."""
+    batch_requests = []
+    for i, incident in enumerate(incidents):
+        incident_type = predict_incident_type(incident)
+        prompt = _PROMPT_TEMPLATES[incident_type].format(incident=incident)
+        batch_requests.append({
+            "request": {"contents": [{"parts": [{"text": prompt}]}]},
+            "metadata": {"key": str(i)},
+        })
+    data = {
+        "batch": {
+            "display_name": "bulk-incident-rca",
+            "input_config": {"requests": {"requests": batch_requests}},
+        }
+    }
+    response = get_session().post(BATCH_API_URL, json=data, timeout=60)
+    response.raise_for_status()
+    return orjson.loads(response.content)["name"]
 
-        except Exception as e:
-            st.error(f"Error during LLM generation: {e}")
-            return "Unable to perform analysis. Please check your API key and network connection."
+def poll_batch_analysis(operation_name: str) -> Dict:
+    """Fetch the current state of a previously submitted batch job."""
+    response = get_session().get(OPERATION_URL.format(name=operation_name), timeout=30)
+    response.raise_for_status()
+    return orjson.loads(response.content)
 
 # --- Streamlit UI ---
 st.set_page_config(page_title="GenAI Root Cause Analyst", layout="wide")
@@ -160,9 +279,62 @@ if st.button("🚀 Analyze Incident", use_container_width=True, type="primary"):
     else:
         st.markdown("### Analysis Report")
         with st.container():
-            # Start the agentic workflow
-            report = agent_root_cause_analysis(incident_description)
-            st.markdown(report)
+            # Start the agentic workflow; the report streams in as it is generated.
+            agent_root_cause_analysis(incident_description)
+
+st.markdown("---")
+st.markdown("### 📦 Bulk Analyze")
+st.markdown("""
+For non-urgent triage of accumulated incidents, upload a file with one incident per line
+(plain text, or JSONL with an `incident` field). The whole set is submitted as a single
+Gemini Batch API job — roughly half the cost of interactive calls — and results are
+collected once the job completes.
+""")
+
+uploaded_file = st.file_uploader("Upload incidents (TXT or JSONL):", type=["txt", "jsonl"])
+
+if uploaded_file is not None and st.button("📤 Submit batch job"):
+    lines = [line.strip() for line in uploaded_file.getvalue().decode("utf-8").splitlines() if line.strip()]
+    # JSONL rows carry the incident in an 'incident' field; anything else is
+    # treated as raw incident text, one per line. A plain-text line that
+    # merely starts with '{' (e.g. a pasted log fragment) is kept as text.
+    incidents = []
+    for line in lines:
+        if line.startswith("{"):
+            try:
+                incidents.append(orjson.loads(line).get("incident", ""))
+            except orjson.JSONDecodeError:
+                incidents.append(line)
+        else:
+            incidents.append(line)
+    incidents = [incident for incident in incidents if incident]
+    if not incidents:
+        st.warning("No incidents found in the uploaded file.")
+    else:
+        try:
+            st.session_state.batch_operation = submit_batch_analysis(incidents)
+            st.info(f"Batch job submitted for {len(incidents)} incidents: `{st.session_state.batch_operation}`")
+        except Exception as e:
+            st.error(f"Error submitting batch job: {e}")
+
+if "batch_operation" in st.session_state and st.button("🔄 Check batch status"):
+    try:
+        operation = poll_batch_analysis(st.session_state.batch_operation)
+        if not operation.get("done"):
+            state = operation.get("metadata", {}).get("state", "running")
+            st.info(f"Batch job is still in progress ({state}). Check again in a few seconds.")
+        else:
+            st.success("✅ Batch job complete!")
+            inlined = operation.get("response", {}).get("inlinedResponses", {}).get("inlinedResponses", [])
+            for item in inlined:
+                try:
+                    text = item["response"]["candidates"][0]["content"]["parts"][0]["text"]
+                except (KeyError, IndexError):
+                    text = f"No response returned: {item.get('error', 'unknown error')}"
+                st.markdown(text)
+                st.markdown("---")
+    except Exception as e:
+        st.error(f"Error polling batch job: {e}")
 
 st.markdown("---")
 st.caption("Conceptual Demo powered by Streamlit and the Gemini API.")